@@ -1,5 +1,11 @@
 import os
+import json
+import logging
 import boto3
+import botocore.session
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
 # --- Thresholds ---
@@ -8,151 +14,366 @@ EC2_CPU_THRESHOLD = float(os.environ.get("EC2_CPU_THRESHOLD", 10))
 RDS_CPU_THRESHOLD = float(os.environ.get("RDS_CPU_THRESHOLD", 10))
 EBS_IO_THRESHOLD = float(os.environ.get("EBS_IO_THRESHOLD", 1))
 ELB_REQUEST_THRESHOLD = float(os.environ.get("ELB_REQUEST_THRESHOLD", 1))
+# Daily cost (USD) above which an alert is sent even when nothing is underutilized; unset disables it
+COST_ALERT_THRESHOLD = float(os.environ.get("COST_ALERT_THRESHOLD", "inf"))
 
-# Helper Function: Get average CPU or I/O over last 24 hours
-def get_avg_cpu_utilization(cloudwatch, namespace, metric_name, dimension_name, identifier):
-    metrics = cloudwatch.get_metric_statistics(
-        Namespace=namespace,
-        MetricName=metric_name,
-        Dimensions=[{"Name": dimension_name, "Value": identifier}], # Give stats for this specific instance ID
-        StartTime=datetime.utcnow() - timedelta(hours=24), # StartTime/EndTime checks last 24 hours
-        EndTime=datetime.utcnow(),
-        Period=3600, # Every 1 hour
-        Statistics=["Average"] # Get average CPU % in each period
+# --- Report Formats ---
+# Alert lines per resource category, filled with the resource ID followed by its metric values
+UNDERUTILIZED_FORMATS = {
+    "EC2": "EC2 Instance {0}: {1}% avg CPU",
+    "RDS": "RDS Instance {0}: {1}% avg CPU",
+    "EBS": "EBS Volume {0}: Low I/O activity (ReadOps: {1}, WriteOps: {2})",
+    "ELBv2": "ELBv2 {0}: Low traffic ({1} requests/hour)",
+}
+UTILIZED_FORMATS = {
+    "EC2": "EC2 Instance {0}: {1}% avg CPU (OK)",
+    "RDS": "RDS Instance {0}: {1}% avg CPU (OK)",
+    "EBS": "EBS Volume {0}: ReadOps: {1}, WriteOps: {2} (OK)",
+    "ELBv2": "ELBv2 {0}: {1} requests/hour (OK)",
+}
+
+# How RDS instances are discovered: "rds" uses DescribeDBInstances, "tagging" uses the
+# Resource Groups Tagging API to stay clear of RDS control plane throttling at account scale
+# (note the Tagging API only returns resources that have, or once had, at least one tag)
+RDS_DISCOVERY = os.environ.get("RDS_DISCOVERY", "rds")
+
+# Resources per Step Functions Map iteration
+PARTITION_SIZE = int(os.environ.get("PARTITION_SIZE", 100))
+
+# Timestamp format shared by the FlaggedAt tag and the state passed between Step Functions states
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+# S3 bucket holding the partitions and results of Step Functions runs, which are too large for state payloads
+SCAN_BUCKET = os.environ.get("SCAN_BUCKET")
+
+# --- Logging ---
+# Per-resource details are logged at DEBUG; set LOG_LEVEL=DEBUG to see them
+logger = logging.getLogger()
+logger.setLevel(os.environ.get("LOG_LEVEL", "INFO").upper())
+
+# --- AWS Clients ---
+# Created once per Lambda container and reused across warm invocations
+# Adaptive retries back off on throttling instead of failing the scan, and the connection
+# pool is sized above the discovery thread pool so parallel calls don't queue for a connection
+client_config = Config(retries={"max_attempts": 10, "mode": "adaptive"}, max_pool_connections=50)
+# One explicit session so credentials, service models and endpoint data are resolved once for all clients
+session = boto3.Session(botocore_session=botocore.session.get_session())
+cloudwatch = session.client("cloudwatch", config=client_config)
+ec2 = session.client("ec2", config=client_config)
+rds = session.client("rds", config=client_config)
+elbv2 = session.client("elbv2", config=client_config)
+sns = session.client("sns", config=client_config)
+ce = session.client("ce", config=client_config)
+ssm = session.client("ssm", config=client_config)
+tagging = session.client("resourcegroupstaggingapi", config=client_config)
+s3 = session.client("s3", config=client_config)
+
+# Drain every page of a paginated describe call and return the items matched by the JMESPath expression
+def describe_all(client, operation, expression, page_size, **kwargs):
+    paginator = client.get_paginator(operation)
+    pages = paginator.paginate(PaginationConfig={"PageSize": page_size}, **kwargs)
+    return list(pages.search(expression))
+
+# Utilization is averaged over this window; resources younger than it are skipped
+METRIC_WINDOW = timedelta(hours=24)
+
+# Discover RDS instances through the Resource Groups Tagging API instead of DescribeDBInstances
+# Only the identifier is available, so the result mirrors the DBInstances entries used by the handler
+# with InstanceCreateTime explicitly set to None to mark the creation time as unknown
+def describe_db_instances_by_tags(tagging_client):
+    arns = describe_all(tagging_client, "get_resources", "ResourceTagMappingList[].ResourceARN", 100, ResourceTypeFilters=["rds:db"])
+    return [{"DBInstanceIdentifier": arn.split(":")[-1], "InstanceCreateTime": None} for arn in arns]
+
+# GetMetricData accepts at most 500 queries per request
+MAX_METRIC_DATA_QUERIES = 500
+
+# Helper Function: Get average CPU or I/O over last 24 hours for many metrics at once
+# Each query is a (namespace, metric_name, dimension_name, identifier) tuple; returns a dict keyed by query
+def batch_get_averages(cloudwatch, queries, start_time, end_time):
+    values = {}
+
+    # Identical queries (e.g. several target groups behind one load balancer) are only requested once
+    queries = list(dict.fromkeys(queries))
+
+    # Pack queries into as few GetMetricData requests as possible
+    for offset in range(0, len(queries), MAX_METRIC_DATA_QUERIES):
+        chunk = queries[offset:offset + MAX_METRIC_DATA_QUERIES]
+        metric_queries = [
+            {
+                "Id": f"m{offset + i}",
+                "MetricStat": {
+                    "Metric": {
+                        "Namespace": namespace,
+                        "MetricName": metric_name,
+                        "Dimensions": [{"Name": dimension_name, "Value": identifier}] # Give stats for this specific resource
+                    },
+                    "Period": int(METRIC_WINDOW.total_seconds()), # One period spanning the whole window
+                    "Stat": "Average" # CloudWatch returns the window's average directly
+                }
+            }
+            for i, (namespace, metric_name, dimension_name, identifier) in enumerate(chunk)
+        ]
+
+        # Results for one query can be split across pages, so accumulate by Id
+        paginator = cloudwatch.get_paginator("get_metric_data")
+        for page in paginator.paginate(
+            MetricDataQueries=metric_queries,
+            StartTime=start_time,
+            EndTime=end_time,
+            ScanBy="TimestampDescending" # Most recent datapoint first
+        ):
+            for result in page["MetricDataResults"]:
+                values.setdefault(result["Id"], []).extend(result["Values"])
+
+    averages = {}
+    for i, query in enumerate(queries):
+        datapoints = values.get(f"m{i}")
+        averages[query] = round(datapoints[0], 2) if datapoints else None
+    return averages
+
+# Check whether a described EC2 instance or EBS volume already carries the Underutilized tag
+def is_flagged(resource):
+    return any(
+        tag["Key"] == "Underutilized" and tag["Value"] == "True"
+        for tag in resource.get("Tags", [])
     )
-    
-    datapoints = metrics["Datapoints"]
-    if datapoints:
-        avg_cpu = sum(dp["Average"] for dp in datapoints) / len(datapoints)
-        return round(avg_cpu, 2)
-    return None
-
-# Tag EC2 or EBS resources as underutilized
-def tag_resource(ec2_client, resource_id):
+
+# CreateTags accepts at most 1000 resource IDs per request
+MAX_CREATE_TAGS_RESOURCES = 1000
+
+# Tag EC2 or EBS resources as underutilized, batching as many IDs per call as possible
+def tag_resources(ec2_client, resource_ids, flagged_at):
     tags = [
         {"Key": "Underutilized", "Value": "True"},
-        {"Key": "FlaggedAt", "Value": datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")}
+        {"Key": "FlaggedAt", "Value": flagged_at}
     ]
-    print("\nTagging resource as underutilized:")
-    print(f"  - Resource ID: {resource_id}")
-    print(f"  - Tags: {tags}\n")
-    ec2_client.create_tags(Resources=[resource_id], Tags=tags)
-
-# Get yesterday's AWS cost using Cost Explorer
-def get_cost_estimate(ce_client):
-    start = (datetime.utcnow() - timedelta(days=1)).strftime('%Y-%m-%d')
-    end = datetime.utcnow().strftime('%Y-%m-%d')
+    logger.debug("Tagging resources as underutilized: %s with tags %s", resource_ids, tags)
+    for offset in range(0, len(resource_ids), MAX_CREATE_TAGS_RESOURCES):
+        ec2_client.create_tags(Resources=resource_ids[offset:offset + MAX_CREATE_TAGS_RESOURCES], Tags=tags)
+
+# SSM parameter used to cache the daily cost between invocations, stored as "<date>=<cost>"
+COST_CACHE_PARAMETER = "/costcache/daily-cost"
+
+# Get the most recent finalized daily AWS cost using Cost Explorer
+# Yesterday's cost is still being updated, so the day before it is reported instead
+# Cost Explorer charges per request, so the result is cached in SSM for the rest of the day;
+# the cache is best-effort and any SSM failure falls back to calling Cost Explorer directly
+def get_cost_estimate(ce_client, ssm_client, today):
+    try:
+        cached = ssm_client.get_parameter(Name=COST_CACHE_PARAMETER)["Parameter"]["Value"]
+        cached_date, cached_cost = cached.split("=", 1)
+        if cached_date == today.isoformat():
+            return float(cached_cost)
+    except (ClientError, ValueError) as e: # ParameterNotFound is a ClientError
+        logger.debug("Cost cache unavailable, querying Cost Explorer: %s", e)
+
+    start = (today - timedelta(days=2)).isoformat()
+    end = (today - timedelta(days=1)).isoformat()
     result = ce_client.get_cost_and_usage(
         TimePeriod={"Start": start, "End": end},
         Granularity="DAILY",
         Metrics=["UnblendedCost"]
     )
     amount = result['ResultsByTime'][0]['Total']['UnblendedCost']['Amount']
-    return round(float(amount), 2)
+    estimated_cost = round(float(amount), 2)
 
-# Main Lambda Handler
-def lambda_handler(event, context):
-    sns_arn = os.environ.get("SNS_TOPIC_ARN")
-    cloudwatch = boto3.client("cloudwatch")
-    ec2 = boto3.client("ec2")
-    rds = boto3.client("rds")
-    elbv2 = boto3.client("elbv2")
-    sns = boto3.client("sns")
-    ce = boto3.client("ce")
-
-    underutilized_resources = []
-    utilized_resources = []
+    try:
+        ssm_client.put_parameter(Name=COST_CACHE_PARAMETER, Value=f"{today.isoformat()}={estimated_cost}", Type="String", Overwrite=True)
+    except ClientError as e:
+        logger.warning("Could not cache cost estimate in SSM: %s", e)
+    return estimated_cost
 
-    # --- EC2 Check ---
-    # Loop through running instances and get average CPU utilization
-    ec2_response = ec2.describe_instances(Filters=[
+# --- Discovery ---
+# Describe every service concurrently on the given executor and reduce each resource to the
+# JSON-serializable fields the checks need, so the result can be passed between Lambdas
+def discover_resources(executor, now):
+    instances_future = executor.submit(describe_all, ec2, "describe_instances", "Reservations[].Instances[]", 1000, Filters=[
         {"Name": "instance-state-name", "Values": ["running"]}
     ])
+    if RDS_DISCOVERY == "tagging":
+        dbs_future = executor.submit(describe_db_instances_by_tags, tagging)
+    else:
+        dbs_future = executor.submit(describe_all, rds, "describe_db_instances", "DBInstances[]", 100)
+    volumes_future = executor.submit(describe_all, ec2, "describe_volumes", "Volumes[]", 500, Filters=[
+        {"Name": "status", "Values": ["in-use"]}
+    ])
+    target_groups_future = executor.submit(describe_all, elbv2, "describe_target_groups", "TargetGroups[]", 400)
+
+    instances = instances_future.result()
+    dbs = dbs_future.result()
+    volumes = volumes_future.result()
+    target_groups = target_groups_future.result()
+
+    # EC2 filters can't exclude a tag, so already-flagged resources are found client-side;
+    # they keep their original FlaggedAt tag and are not re-tagged on every run
+    return {
+        # Running instances, skipping ones launched within the metric window since they lack a full day of data
+        "ec2": [
+            {"id": instance["InstanceId"], "flagged": is_flagged(instance)}
+            for instance in instances
+            if now - instance["LaunchTime"].replace(tzinfo=None) >= METRIC_WINDOW
+        ],
+        # All RDS instances, skipping ones created within the metric window (or still being created);
+        # creation time is unknown (None) when discovered via the Tagging API, so those are always checked
+        "rds": [
+            {"id": db["DBInstanceIdentifier"]}
+            for db in dbs
+            if "InstanceCreateTime" in db and (
+                db["InstanceCreateTime"] is None
+                or now - db["InstanceCreateTime"].replace(tzinfo=None) >= METRIC_WINDOW
+            )
+        ],
+        # In-use volumes
+        "ebs": [{"id": vol["VolumeId"], "flagged": is_flagged(vol)} for vol in volumes],
+        # Target groups with their load balancer ARN suffix for the RequestCount metric
+        "elbv2": [
+            {"id": tg["TargetGroupName"], "load_balancer": tg["LoadBalancerArns"][0].split('/')[-1]}
+            for tg in target_groups
+        ],
+    }
+
+# --- Resource Checks ---
+# Each service lists the metric queries its resources need, and classifies them from the fetched
+# averages into (underutilized, utilized, to_tag); results are (category, resource_id, values) tuples
+
+def ec2_queries(instances):
+    return [("AWS/EC2", "CPUUtilization", "InstanceId", instance["id"]) for instance in instances]
 
-    for reservation in ec2_response["Reservations"]:
-        for instance in reservation["Instances"]:
-            instance_id = instance["InstanceId"]
-            avg_cpu = get_avg_cpu_utilization(cloudwatch, "AWS/EC2", "CPUUtilization", "InstanceId", instance_id)
-            if avg_cpu is not None:
-                if avg_cpu < EC2_CPU_THRESHOLD:
-                    underutilized_resources.append(f"EC2 Instance {instance_id}: {avg_cpu}% avg CPU")
-                    tag_resource(ec2, instance_id)
-                else:
-                    utilized_resources.append(f"EC2 Instance {instance_id}: {avg_cpu}% avg CPU (OK)")
-
-    # --- RDS Check---
-    # Loop through all RDS instances and check CPU utilization
-    rds_response = rds.describe_db_instances()
-    for db in rds_response["DBInstances"]:
-        db_id = db["DBInstanceIdentifier"]
-        avg_cpu = get_avg_cpu_utilization(cloudwatch, "AWS/RDS", "CPUUtilization", "DBInstanceIdentifier", db_id)
+# Classify running instances by average CPU utilization
+def check_ec2(instances, averages):
+    underutilized, utilized, to_tag = [], [], []
+    for instance in instances:
+        avg_cpu = averages[("AWS/EC2", "CPUUtilization", "InstanceId", instance["id"])]
+        if avg_cpu is not None:
+            if avg_cpu < EC2_CPU_THRESHOLD:
+                underutilized.append(("EC2", instance["id"], (avg_cpu,)))
+                if not instance["flagged"]:
+                    to_tag.append(instance["id"])
+            else:
+                utilized.append(("EC2", instance["id"], (avg_cpu,)))
+    return underutilized, utilized, to_tag
+
+def rds_queries(dbs):
+    return [("AWS/RDS", "CPUUtilization", "DBInstanceIdentifier", db["id"]) for db in dbs]
+
+# Classify RDS instances by average CPU utilization
+def check_rds(dbs, averages):
+    underutilized, utilized = [], []
+    for db in dbs:
+        avg_cpu = averages[("AWS/RDS", "CPUUtilization", "DBInstanceIdentifier", db["id"])]
         if avg_cpu is not None:
             if avg_cpu < RDS_CPU_THRESHOLD:
-                underutilized_resources.append(f"RDS Instance {db_id}: {avg_cpu}% avg CPU")
+                underutilized.append(("RDS", db["id"], (avg_cpu,)))
             else:
-                utilized_resources.append(f"RDS Instance {db_id}: {avg_cpu}% avg CPU (OK)")
+                utilized.append(("RDS", db["id"], (avg_cpu,)))
+    return underutilized, utilized, []
 
-    # --- EBS Check ---
-    # Evaluate I/O for in-use volumes and check if under threshold
-    volumes = ec2.describe_volumes(Filters=[
-        {"Name": "status", "Values": ["in-use"]}
-    ])["Volumes"]
+def ebs_queries(volumes):
+    return (
+        [("AWS/EBS", "VolumeReadOps", "VolumeId", vol["id"]) for vol in volumes]
+        + [("AWS/EBS", "VolumeWriteOps", "VolumeId", vol["id"]) for vol in volumes]
+    )
 
+# Evaluate I/O for in-use volumes and check if under threshold
+def check_ebs(volumes, averages):
+    underutilized, utilized, to_tag = [], [], []
     for vol in volumes:
-        vol_id = vol["VolumeId"]
-        read_ops = get_avg_cpu_utilization(cloudwatch, "AWS/EBS", "VolumeReadOps", "VolumeId", vol_id)
-        write_ops = get_avg_cpu_utilization(cloudwatch, "AWS/EBS", "VolumeWriteOps", "VolumeId", vol_id)
+        read_ops = averages[("AWS/EBS", "VolumeReadOps", "VolumeId", vol["id"])]
+        write_ops = averages[("AWS/EBS", "VolumeWriteOps", "VolumeId", vol["id"])]
 
         if read_ops is not None and write_ops is not None:
             if read_ops < EBS_IO_THRESHOLD and write_ops < EBS_IO_THRESHOLD:
-                underutilized_resources.append(f"EBS Volume {vol_id}: Low I/O activity (ReadOps: {read_ops}, WriteOps: {write_ops})")
-                tag_resource(ec2, vol_id)
+                underutilized.append(("EBS", vol["id"], (read_ops, write_ops)))
+                if not vol["flagged"]:
+                    to_tag.append(vol["id"])
             else:
-                utilized_resources.append(f"EBS Volume {vol_id}: ReadOps: {read_ops}, WriteOps: {write_ops} (OK)")
+                utilized.append(("EBS", vol["id"], (read_ops, write_ops)))
+    return underutilized, utilized, to_tag
 
-    # --- ELBv2 Check ---
-    # Check application load balancer traffic levels via RequestCount metric
-    target_groups = elbv2.describe_target_groups()["TargetGroups"]
+def elbv2_queries(target_groups):
+    return [("AWS/ApplicationELB", "RequestCount", "LoadBalancer", tg["load_balancer"]) for tg in target_groups]
 
+# Check application load balancer traffic levels via RequestCount metric
+def check_elbv2(target_groups, averages):
+    underutilized, utilized = [], []
     for tg in target_groups:
-        tg_name = tg["TargetGroupName"]
-        lb_arn_suffix = tg["LoadBalancerArns"][0].split('/')[-1]
-
-        requests = get_avg_cpu_utilization(
-            cloudwatch,
-            namespace="AWS/ApplicationELB",
-            metric_name="RequestCount",
-            dimension_name="LoadBalancer",
-            identifier=lb_arn_suffix
-        ) 
+        requests = averages[("AWS/ApplicationELB", "RequestCount", "LoadBalancer", tg["load_balancer"])]
 
         if requests is not None:
             if requests < ELB_REQUEST_THRESHOLD:
-                underutilized_resources.append(f"ELBv2 {tg_name}: Low traffic ({requests} requests/hour)")
+                underutilized.append(("ELBv2", tg["id"], (requests,)))
             else:
-                utilized_resources.append(f"ELBv2 {tg_name}: {requests} requests/hour (OK)")
+                utilized.append(("ELBv2", tg["id"], (requests,)))
+    return underutilized, utilized, []
+
+SERVICE_CHECKS = {
+    "ec2": (ec2_queries, check_ec2),
+    "rds": (rds_queries, check_rds),
+    "ebs": (ebs_queries, check_ebs),
+    "elbv2": (elbv2_queries, check_elbv2),
+}
+
+# Check discovered resources ({service: resources}) with one batched metric fetch, then tag flagged ones
+def run_checks(resources, now):
+    # Metric window, computed once and shared by every query
+    end_time = now.replace(minute=0, second=0, microsecond=0) # Align to the hour so the window is a single period
+    start_time = end_time - METRIC_WINDOW # StartTime/EndTime checks last 24 hours
+
+    # Request every metric in one batched GetMetricData pass instead of one call per resource
+    queries = [
+        query
+        for service, items in resources.items()
+        for query in SERVICE_CHECKS[service][0](items)
+    ]
+    averages = batch_get_averages(cloudwatch, queries, start_time, end_time)
+
+    underutilized_resources = []
+    utilized_resources = []
+    to_tag = [] # EC2 instances and EBS volumes to tag once all checks are done
+    for service, items in resources.items():
+        underutilized, utilized, flagged = SERVICE_CHECKS[service][1](items, averages)
+        underutilized_resources.extend(underutilized)
+        utilized_resources.extend(utilized)
+        to_tag.extend(flagged)
+
+    # Tag every flagged EC2 instance and EBS volume in one pass
+    if to_tag:
+        tag_resources(ec2, to_tag, now.strftime(TIMESTAMP_FORMAT))
+
+    return underutilized_resources, utilized_resources
+
+# --- Alerting ---
+# Compose and publish the SNS alert, skipping it when there is nothing to act on
+def send_alert(underutilized_resources, utilized_resources, estimated_cost):
+    sns_arn = os.environ.get("SNS_TOPIC_ARN")
+    logger.info("Flagged %d underutilized resources", len(underutilized_resources))
 
-    # Cost Estimation 
-    estimated_cost = get_cost_estimate(ce)
+    # Only alert when there is something to act on
+    if not underutilized_resources and estimated_cost <= COST_ALERT_THRESHOLD:
+        return {
+            "statusCode": 200,
+            "body": "Utilization scan complete. No alert sent."
+        }
 
     # Compose Alert Message
-    message_parts = []
+    # Build a flat list of lines and join once at the end
+    lines = []
 
     if underutilized_resources:
-        message_parts.append("UNDERUTILIZED AWS RESOURCES DETECTED")
-        message_parts.append("\n".join(f"• {r}" for r in underutilized_resources))
-        message_parts.append("Consider rightsizing or terminating these resources.\n")
+        lines.append("UNDERUTILIZED AWS RESOURCES DETECTED")
+        lines.extend(f"- {UNDERUTILIZED_FORMATS[category].format(resource_id, *values)}" for category, resource_id, values in underutilized_resources)
+        lines.extend(["", "Consider rightsizing or terminating these resources.", ""])
 
     if utilized_resources:
-        message_parts.append("UTILIZED RESOURCES (HEALTHY)")
-        message_parts.append("\n".join(f"• {r}" for r in utilized_resources))
+        lines.append("UTILIZED RESOURCES (HEALTHY)")
+        lines.extend(f"- {UTILIZED_FORMATS[category].format(resource_id, *values)}" for category, resource_id, values in utilized_resources)
+        lines.append("")
 
-    message_parts.append(f"\nEstimated Daily AWS Cost: ${estimated_cost}")
-    message = "\n\n".join(message_parts)
+    lines.append(f"Estimated Daily AWS Cost: ${estimated_cost}")
+    message = "\n".join(lines)
 
     # Send SNS Notification
-    print("Sending the following SNS alert:\n")
-    print(message)
+    logger.debug("Sending the following SNS alert:\n%s", message)
     sns.publish(
         TopicArn=sns_arn,
         Subject="AWS Underutilized Resource Alert",
@@ -163,3 +384,75 @@ def lambda_handler(event, context):
         "statusCode": 200,
         "body": "Utilization scan complete."
     }
+
+# Main Lambda Handler
+# Runs the whole scan in a single invocation; large accounts use the Step Functions handlers below
+def lambda_handler(event, context):
+    now = datetime.utcnow()
+
+    # Paginated describe calls (and the Cost Explorer lookup) are independent, so run them concurrently
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        cost_future = executor.submit(get_cost_estimate, ce, ssm, now.date())
+        resources = discover_resources(executor, now)
+        estimated_cost = cost_future.result()
+
+    underutilized_resources, utilized_resources = run_checks(resources, now)
+    return send_alert(underutilized_resources, utilized_resources, estimated_cost)
+
+# --- Step Functions Handlers ---
+# Discover -> Distributed Map over partitions (one scan_* Lambda per partition) -> Report
+# Partitions and results go through SCAN_BUCKET so state payloads stay small regardless of account size
+
+# Discover resources, split each service into partitions of PARTITION_SIZE and write them to S3 for the Map state
+def discover_handler(event, context):
+    now = datetime.utcnow()
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        resources = discover_resources(executor, now)
+
+    started_at = now.strftime(TIMESTAMP_FORMAT)
+    partitions = [
+        {"service": service, "resources": items[offset:offset + PARTITION_SIZE], "started_at": started_at}
+        for service, items in resources.items()
+        for offset in range(0, len(items), PARTITION_SIZE)
+    ]
+
+    partitions_key = f"scans/{started_at}/partitions.json"
+    s3.put_object(Bucket=SCAN_BUCKET, Key=partitions_key, Body=json.dumps(partitions))
+    return {"partitions_key": partitions_key, "started_at": started_at}
+
+# Check a single partition produced by discover_handler
+def scan_partition(service, event):
+    now = datetime.strptime(event["started_at"], TIMESTAMP_FORMAT)
+    underutilized_resources, utilized_resources = run_checks({service: event["resources"]}, now)
+    return {"underutilized": underutilized_resources, "utilized": utilized_resources}
+
+def scan_ec2(event, context):
+    return scan_partition("ec2", event)
+
+def scan_rds(event, context):
+    return scan_partition("rds", event)
+
+def scan_ebs(event, context):
+    return scan_partition("ebs", event)
+
+def scan_elbv2(event, context):
+    return scan_partition("elbv2", event)
+
+# Read partition results written by the Map state's ResultWriter, following its manifest
+def read_map_results(bucket, manifest_key):
+    manifest = json.loads(s3.get_object(Bucket=bucket, Key=manifest_key)["Body"].read())
+    results = []
+    for result_file in manifest["ResultFiles"].get("SUCCEEDED", []):
+        executions = json.loads(s3.get_object(Bucket=bucket, Key=result_file["Key"])["Body"].read())
+        results.extend(json.loads(execution["Output"]) for execution in executions)
+    return results
+
+# Merge the Map state's partition results and send a single alert
+def report_handler(event, context):
+    now = datetime.utcnow()
+    writer = event["results"]["ResultWriterDetails"]
+    results = read_map_results(writer["Bucket"], writer["Key"])
+    underutilized_resources = [resource for result in results for resource in result["underutilized"]]
+    utilized_resources = [resource for result in results for resource in result["utilized"]]
+    estimated_cost = get_cost_estimate(ce, ssm, now.date())
+    return send_alert(underutilized_resources, utilized_resources, estimated_cost)
@@ -125,6 +125,29 @@ resource "aws_iam_role_policy_attachment" "attach_rds_read_policy" {
   policy_arn = aws_iam_policy.rds_read_policy.arn
 }
 
+// Allow Lambda to discover RDS instances via the Resource Groups Tagging API (RDS_DISCOVERY = "tagging")
+resource "aws_iam_policy" "tagging_read_policy" {
+  name        = "tagging-read-policy"
+  description = "Allows Lambda to list tagged resources"
+  policy = jsonencode({
+    Version = "2012-10-17",
+    Statement = [
+      {
+        Effect = "Allow",
+        Action = [
+          "tag:GetResources"
+        ],
+        Resource = "*"
+      }
+    ]
+  })
+}
+
+resource "aws_iam_role_policy_attachment" "attach_tagging_read_policy" {
+  role       = aws_iam_role.lambda_exec_role.name
+  policy_arn = aws_iam_policy.tagging_read_policy.arn
+}
+
 // Allow Lambda to access ELBv2 metrics for utilization
 resource "aws_iam_policy" "elbv2_read_policy" {
   name        = "elbv2-read-policy"
@@ -173,6 +196,30 @@ resource "aws_iam_role_policy_attachment" "attach_cost_explorer_policy" {
   policy_arn = aws_iam_policy.cost_explorer_policy.arn
 }
 
+// Allow Lambda to cache the daily cost estimate in SSM Parameter Store
+resource "aws_iam_policy" "cost_cache_policy" {
+  name        = "cost-cache-policy"
+  description = "Allows Lambda to read and write cached cost estimates"
+  policy = jsonencode({
+    Version = "2012-10-17",
+    Statement = [
+      {
+        Effect = "Allow",
+        Action = [
+          "ssm:GetParameter",
+          "ssm:PutParameter"
+        ],
+        Resource = "arn:aws:ssm:*:*:parameter/costcache/daily-cost"
+      }
+    ]
+  })
+}
+
+resource "aws_iam_role_policy_attachment" "attach_cost_cache_policy" {
+  role       = aws_iam_role.lambda_exec_role.name
+  policy_arn = aws_iam_policy.cost_cache_policy.arn
+}
+
 // SNS topic to receive underutilized resource alerts
 resource "aws_sns_topic" "alert_topic" {
   name = "underutilized-resource-alerts"
@@ -185,15 +232,22 @@ resource "aws_sns_topic_subscription" "email_alert" {
   endpoint  = var.alert_email
 }
 
-// Deploy the Python Lambda that checks for underutilized resources
+// Package the Lambda source at plan time so the deployed zip always matches lambda/main.py
+data "archive_file" "lambda_zip" {
+  type        = "zip"
+  source_file = "${path.module}/lambda/main.py"
+  output_path = "${path.module}/lambda/lambda.zip"
+}
+
+// Deploy the Python Lambda that checks for underutilized resources in a single invocation (manual runs)
 resource "aws_lambda_function" "resource_checker" {
   function_name = "underutilized-resource-checker"
   handler       = "main.lambda_handler"
   runtime       = "python3.11"
   role          = aws_iam_role.lambda_exec_role.arn
-  filename      = "${path.module}/lambda/lambda.zip"
+  filename      = data.archive_file.lambda_zip.output_path
 
-  source_code_hash = filebase64sha256("${path.module}/lambda/lambda.zip")
+  source_code_hash = data.archive_file.lambda_zip.output_base64sha256
 
   timeout = 60
 
@@ -204,26 +258,287 @@ resource "aws_lambda_function" "resource_checker" {
   }
 }
 
-// CloudWatch rule to trigger Lambda once per day
+// S3 bucket holding Step Functions partitions and Map results (too large for state payloads)
+resource "aws_s3_bucket" "scan_state" {
+  bucket_prefix = "underutilized-resource-scan-"
+  force_destroy = true
+}
+
+resource "aws_s3_bucket_public_access_block" "scan_state" {
+  bucket                  = aws_s3_bucket.scan_state.id
+  block_public_acls       = true
+  block_public_policy     = true
+  ignore_public_acls      = true
+  restrict_public_buckets = true
+}
+
+// Scan state is only needed for the duration of a run
+resource "aws_s3_bucket_lifecycle_configuration" "scan_state" {
+  bucket = aws_s3_bucket.scan_state.id
+
+  rule {
+    id     = "expire-scan-state"
+    status = "Enabled"
+
+    filter {}
+
+    expiration {
+      days = 7
+    }
+  }
+}
+
+// Allow Lambda to write partitions and read Map results in the scan bucket
+resource "aws_iam_policy" "scan_state_policy" {
+  name        = "scan-state-policy"
+  description = "Allows Lambda to read and write Step Functions scan state"
+  policy = jsonencode({
+    Version = "2012-10-17",
+    Statement = [
+      {
+        Effect = "Allow",
+        Action = [
+          "s3:GetObject",
+          "s3:PutObject"
+        ],
+        Resource = "${aws_s3_bucket.scan_state.arn}/*"
+      }
+    ]
+  })
+}
+
+resource "aws_iam_role_policy_attachment" "attach_scan_state_policy" {
+  role       = aws_iam_role.lambda_exec_role.name
+  policy_arn = aws_iam_policy.scan_state_policy.arn
+}
+
+// Step Functions stages: discovery, one scanner per service, and the final report
+locals {
+  scan_stages = {
+    discover = "main.discover_handler"
+    ec2      = "main.scan_ec2"
+    rds      = "main.scan_rds"
+    ebs      = "main.scan_ebs"
+    elbv2    = "main.scan_elbv2"
+    report   = "main.report_handler"
+  }
+}
+
+// Deploy one small Lambda per stage from the same package
+resource "aws_lambda_function" "scan_stage" {
+  for_each = local.scan_stages
+
+  function_name = "underutilized-resource-${each.key}"
+  handler       = each.value
+  runtime       = "python3.11"
+  role          = aws_iam_role.lambda_exec_role.arn
+  filename      = data.archive_file.lambda_zip.output_path
+  memory_size   = 128
+
+  source_code_hash = data.archive_file.lambda_zip.output_base64sha256
+
+  timeout = 60
+
+  environment {
+    variables = {
+      SNS_TOPIC_ARN  = aws_sns_topic.alert_topic.arn
+      PARTITION_SIZE = var.partition_size
+      SCAN_BUCKET    = aws_s3_bucket.scan_state.bucket
+    }
+  }
+}
+
+// IAM role that the state machine will assume
+resource "aws_iam_role" "sfn_exec_role" {
+  name = "underutilized-resource-sfn-role"
+
+  assume_role_policy = jsonencode({
+    Version = "2012-10-17",
+    Statement = [{
+      Effect = "Allow",
+      Principal = {
+        Service = "states.amazonaws.com"
+      },
+      Action = "sts:AssumeRole"
+    }]
+  })
+}
+
+// Allow the state machine to invoke the stage Lambdas, run Distributed Map child executions,
+// and read partitions / write results in the scan bucket
+resource "aws_iam_policy" "sfn_invoke_policy" {
+  name        = "sfn-invoke-policy"
+  description = "Allows Step Functions to invoke the scan Lambdas"
+  policy = jsonencode({
+    Version = "2012-10-17",
+    Statement = [
+      {
+        Effect   = "Allow",
+        Action   = "lambda:InvokeFunction",
+        Resource = [for fn in aws_lambda_function.scan_stage : fn.arn]
+      },
+      {
+        Effect   = "Allow",
+        Action   = "states:StartExecution",
+        Resource = "arn:aws:states:*:*:stateMachine:underutilized-resource-scan"
+      },
+      {
+        Effect = "Allow",
+        Action = [
+          "states:DescribeExecution",
+          "states:StopExecution"
+        ],
+        Resource = "arn:aws:states:*:*:execution:underutilized-resource-scan/*"
+      },
+      {
+        Effect = "Allow",
+        Action = [
+          "s3:GetObject",
+          "s3:PutObject",
+          "s3:ListMultipartUploadParts",
+          "s3:AbortMultipartUpload"
+        ],
+        Resource = "${aws_s3_bucket.scan_state.arn}/*"
+      }
+    ]
+  })
+}
+
+resource "aws_iam_role_policy_attachment" "attach_sfn_invoke_policy" {
+  role       = aws_iam_role.sfn_exec_role.name
+  policy_arn = aws_iam_policy.sfn_invoke_policy.arn
+}
+
+// State machine: discover resources, scan partitions of var.partition_size in parallel, then send one report
+// Discover writes the partitions to S3 and the Distributed Map reads them and writes its results back,
+// so no state carries the resource inventory and the 256 KiB state payload limit doesn't apply
+resource "aws_sfn_state_machine" "resource_scan" {
+  name     = "underutilized-resource-scan"
+  role_arn = aws_iam_role.sfn_exec_role.arn
+
+  definition = jsonencode({
+    StartAt = "Discover",
+    States = {
+      Discover = {
+        Type     = "Task",
+        Resource = aws_lambda_function.scan_stage["discover"].arn,
+        Next     = "ScanPartitions"
+      },
+      ScanPartitions = {
+        Type           = "Map",
+        MaxConcurrency = 10,
+        ItemReader = {
+          Resource = "arn:aws:states:::s3:getObject",
+          ReaderConfig = {
+            InputType = "JSON"
+          },
+          Parameters = {
+            Bucket  = aws_s3_bucket.scan_state.bucket,
+            "Key.$" = "$.partitions_key"
+          }
+        },
+        ResultWriter = {
+          Resource = "arn:aws:states:::s3:putObject",
+          Parameters = {
+            Bucket = aws_s3_bucket.scan_state.bucket,
+            Prefix = "results"
+          }
+        },
+        ResultPath = "$.results",
+        ItemProcessor = {
+          ProcessorConfig = {
+            Mode          = "DISTRIBUTED",
+            ExecutionType = "EXPRESS"
+          },
+          StartAt = "RouteService",
+          States = merge(
+            {
+              RouteService = {
+                Type = "Choice",
+                Choices = [
+                  for service in ["ec2", "rds", "ebs", "elbv2"] : {
+                    Variable     = "$.service",
+                    StringEquals = service,
+                    Next         = "Scan-${service}"
+                  }
+                ]
+              }
+            },
+            {
+              for service in ["ec2", "rds", "ebs", "elbv2"] : "Scan-${service}" => {
+                Type     = "Task",
+                Resource = aws_lambda_function.scan_stage[service].arn,
+                Retry = [{
+                  ErrorEquals     = ["Lambda.TooManyRequestsException", "Lambda.ServiceException"],
+                  IntervalSeconds = 2,
+                  MaxAttempts     = 3,
+                  BackoffRate     = 2
+                }],
+                End = true
+              }
+            }
+          )
+        },
+        Next = "Report"
+      },
+      Report = {
+        Type     = "Task",
+        Resource = aws_lambda_function.scan_stage["report"].arn,
+        End      = true
+      }
+    }
+  })
+}
+
+// CloudWatch rule to trigger the scan once per day
 resource "aws_cloudwatch_event_rule" "daily_trigger" {
   name                = "daily-resource-check"
   schedule_expression = "rate(1 day)"
 }
 
-// Target Lambda for the CloudWatch trigger
-resource "aws_cloudwatch_event_target" "lambda_trigger" {
-  rule      = aws_cloudwatch_event_rule.daily_trigger.name
-  target_id = "check-underutilized"
-  arn       = aws_lambda_function.resource_checker.arn
+// IAM role allowing CloudWatch Events to start the state machine
+resource "aws_iam_role" "events_exec_role" {
+  name = "underutilized-resource-events-role"
+
+  assume_role_policy = jsonencode({
+    Version = "2012-10-17",
+    Statement = [{
+      Effect = "Allow",
+      Principal = {
+        Service = "events.amazonaws.com"
+      },
+      Action = "sts:AssumeRole"
+    }]
+  })
+}
+
+// Allow CloudWatch Events to start the scan state machine
+resource "aws_iam_policy" "events_start_execution_policy" {
+  name        = "events-start-execution-policy"
+  description = "Allows CloudWatch Events to start the scan state machine"
+  policy = jsonencode({
+    Version = "2012-10-17",
+    Statement = [
+      {
+        Effect   = "Allow",
+        Action   = "states:StartExecution",
+        Resource = aws_sfn_state_machine.resource_scan.arn
+      }
+    ]
+  })
 }
 
-// Allow CloudWatch Events to invoke Lambda
-resource "aws_lambda_permission" "allow_cloudwatch" {
-  statement_id  = "AllowExecutionFromCloudWatch"
-  action        = "lambda:InvokeFunction"
-  function_name = aws_lambda_function.resource_checker.function_name
-  principal     = "events.amazonaws.com"
-  source_arn    = aws_cloudwatch_event_rule.daily_trigger.arn
+resource "aws_iam_role_policy_attachment" "attach_events_start_execution_policy" {
+  role       = aws_iam_role.events_exec_role.name
+  policy_arn = aws_iam_policy.events_start_execution_policy.arn
+}
+
+// Target the state machine for the CloudWatch trigger
+resource "aws_cloudwatch_event_target" "sfn_trigger" {
+  rule      = aws_cloudwatch_event_rule.daily_trigger.name
+  target_id = "check-underutilized"
+  arn       = aws_sfn_state_machine.resource_scan.arn
+  role_arn  = aws_iam_role.events_exec_role.arn
 }
 
 // Test instances
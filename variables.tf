@@ -1,4 +1,10 @@
 variable "alert_email" {
   description = "Email address to receive underutilized resource alerts"
   type        = string
-}
\ No newline at end of file
+}
+
+variable "partition_size" {
+  description = "Number of resources checked per Step Functions Map iteration"
+  type        = number
+  default     = 100
+}